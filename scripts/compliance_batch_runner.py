@@ -12,648 +12,757 @@ Usage:
     python scripts/compliance_batch_runner.py --fund-id 1 --date 2024-01-31
     python scripts/compliance_batch_runner.py --fund-id 1 --date 2024-01-31 \
         --input scripts/my_rules.xlsx --output results.xlsx
+    python scripts/compliance_batch_runner.py --fund-id 1 --date 2024-01-31 \
+        --workers 1 --no-cache --breaches-format csv --verbose
+
+Options (see --help): --workers, --no-cache, --legacy-writer,
+--breaches-format {auto,csv,xlsx}, --verbose.
+
+Requires pandas >= 2.0 and openpyxl. Optional: numba (compiled aggregation kernel;
+numpy otherwise) and xlsxwriter (used by --legacy-writer; openpyxl otherwise).
 """
 
 import argparse
+import atexit
+import csv
+import io
+import json
+import math
 import os
+import re
 import sqlite3
+import sys
+import threading
 import traceback
+import zipfile
+from collections import Counter
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime
+from pathlib import Path
+from typing import Literal, NamedTuple
+from xml.sax.saxutils import escape as xml_escape
 
+import numpy as np
 import pandas as pd
-from openpyxl import Workbook
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Font, PatternFill
 from openpyxl.utils import get_column_letter
 
+try:
+    from numba import njit
+    HAVE_NUMBA = True
+except ImportError:  # numba is optional — without it the aggregates fall back to numpy
+    HAVE_NUMBA = False
+
+try:
+    import xlsxwriter
+except ImportError:  # xlsxwriter is optional — write_output falls back to openpyxl
+    xlsxwriter = None
+
 # ---------------------------------------------------------------------------
 # Config
 # ---------------------------------------------------------------------------
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
+PROJECT_ROOT_PATH = Path(PROJECT_ROOT)
 DB_PATH = os.path.join(PROJECT_ROOT, "portfolio.db")
 DEFAULT_RULES_PATH = os.path.join(SCRIPT_DIR, "compliance_rules.xlsx")
+DEFAULT_WORKERS = min(8, os.cpu_count() or 1)
+RESULT_CACHE_SIZE = 1024
+METRICS_CACHE_SIZE = 16
+RESULT_CACHE_PATH = os.path.join(PROJECT_ROOT, ".rule_cache.json")
+
+# MAX_PCT breaches list the positions making up the breached exposure. Only
+# the largest BREACH_DETAIL_LIMIT contributors above the noise floor are
+# reported; rules whose breaches are the violations themselves (Restricted
+# positions, concentration limits) always list every breach.
+BREACH_DETAIL_LIMIT = 100
+BREACH_DETAIL_MIN_WEIGHT = 0.01
+
+# With --breaches-format auto, breach lists longer than this go to a CSV next
+# to the report instead of the Breaches sheet
+BREACH_CSV_THRESHOLD = 10_000
 
 # ---------------------------------------------------------------------------
-# execute_sql — called by generated functions at runtime
+# Connection handling — one read-only connection per thread, reused by every
+# rule check instead of reconnecting per query
 # ---------------------------------------------------------------------------
 
-def execute_sql(sql: str) -> pd.DataFrame:
-    """Execute SQL against portfolio.db and return a DataFrame."""
-    conn = sqlite3.connect(DB_PATH)
+_local = threading.local()
+_open_conns: list[sqlite3.Connection] = []
+_open_conns_lock = threading.Lock()
+_indexes_checked = False
+
+# Covers the positions scan in _load_fund_metrics (filter on fund_id, read in
+# weight order, every selected column in the key), so it is an index-only
+# range scan rather than a full table scan. Declared in src/lib/db/schema.ts
+# and created by `npm run db:push` — the checker never alters the schema.
+POSITIONS_INDEX = "idx_positions_fund_weight"
+
+
+def _check_indexes(conn: sqlite3.Connection):
+    """Warn if the positions covering index has not been pushed to portfolio.db."""
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (POSITIONS_INDEX,)
+    ).fetchone()
+    if not exists:
+        # Queries still work, just unindexed
+        print(f"  [WARN] {POSITIONS_INDEX} is missing — run `npm run db:push` to create it")
+
+
+def _get_conn() -> sqlite3.Connection:
+    """Return this thread's connection to portfolio.db, opening it on first use."""
+    global _indexes_checked
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+        # Per-connection read settings only — nothing here writes, so a
+        # read-only portfolio.db works and its journal mode is left to the app
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA mmap_size=268435456")
+        with _open_conns_lock:
+            if not _indexes_checked:
+                _check_indexes(conn)
+                _indexes_checked = True
+        conn.execute("PRAGMA query_only=ON")
+        _local.conn = conn
+        with _open_conns_lock:
+            # Pool workers register with their pool, which closes them at
+            # shutdown; every other thread's connection lives until exit
+            getattr(_local, "pool_conns", _open_conns).append(conn)
+    return conn
+
+
+def _init_pool_worker(pool_conns: list[sqlite3.Connection]):
+    """ThreadPoolExecutor initializer: route this worker's connection to its pool's list."""
+    _local.pool_conns = pool_conns
+
+
+def _close_pool_conns(pool_conns: list[sqlite3.Connection]):
+    """Close the connections a finished pool's workers opened."""
+    with _open_conns_lock:
+        while pool_conns:
+            pool_conns.pop().close()
+
+
+@atexit.register
+def _close_conns():
+    with _open_conns_lock:
+        while _open_conns:
+            _open_conns.pop().close()
+
+
+def _db_version() -> tuple | None:
+    """Identify the current state of portfolio.db for cache keys.
+
+    In WAL mode commits land in the -wal file until a checkpoint, so its
+    mtime counts alongside the main file's. An empty -wal holds no commits —
+    opening a reader creates one — so it counts the same as no file.
+
+    None when portfolio.db can't be stat'ed: the rule checks then fail on
+    their own query and record ERROR rows, which are never cached.
+    """
     try:
-        return pd.read_sql_query(sql, conn)
-    finally:
-        conn.close()
+        db_mtime = os.path.getmtime(DB_PATH)
+    except OSError:
+        return None
+    try:
+        wal = os.stat(DB_PATH + "-wal")
+    except FileNotFoundError:
+        wal = None
+    return (db_mtime, wal.st_mtime if wal is not None and wal.st_size > 0 else None)
 
 
 # ---------------------------------------------------------------------------
-# Generated compliance functions
-# (SQL authored at generation time via compliance-rule-generator skill,
-#  adapted to the portfolio.db schema: funds + positions tables.
-#  NAV basis: funds.aum_usd (millions); weight basis: positions.weight_pct)
+# execute_sql — called by generated functions at runtime
 # ---------------------------------------------------------------------------
 
-def check_max_equity_exposure(fund_id: str, as_of_date: str, threshold: float = 60.0) -> dict:
-    """
-    Rule: max 60% of portfolio in Equity
-    Rule type: MAX_PCT_NAV
-    Checks that total Equity weight does not exceed threshold%.
+def execute_sql(sql: str, params: tuple = (), dtype: dict | None = None) -> pd.DataFrame:
+    """Execute parameterized SQL against portfolio.db and return a DataFrame."""
+    return pd.read_sql_query(sql, _get_conn(), params=params, dtype=dtype)
 
-    Term resolution: "Equity" = positions with asset_class = 'Equity'
-    Term resolution: "% of NAV" = SUM(weight_pct) for the asset class
-    NOTE: as_of_date not stored in schema; all positions are current snapshot.
-    """
-    rule_text = "max 60% of portfolio in Equity"
-    rule_type = "MAX_PCT_NAV"
-    try:
-        # Query 1: Total Equity weight for the fund
-        # text2sql: "Sum of weight_pct for Equity positions belonging to a given fund"
-        sql_equity = f"""
-            SELECT SUM(weight_pct) AS equity_weight
-            FROM positions
-            WHERE fund_id = {fund_id}
-              AND asset_class = 'Equity'
-        """
-        df = execute_sql(sql_equity)
-        equity_weight = float(df.iloc[0, 0]) if not df.empty and df.iloc[0, 0] is not None else 0.0
-
-        passed = equity_weight <= threshold
-
-        breaches = []
-        if not passed:
-            # Query 2: Position-level breakdown of Equity holdings
-            sql_breach = f"""
-                SELECT isin AS identifier, security_name AS description, weight_pct AS value
-                FROM positions
-                WHERE fund_id = {fund_id}
-                  AND asset_class = 'Equity'
-                ORDER BY weight_pct DESC
-            """
-            df_b = execute_sql(sql_breach)
-            for _, row in df_b.iterrows():
-                breaches.append({
-                    "identifier": str(row.get("identifier") or ""),
-                    "description": str(row.get("description") or ""),
-                    "value": float(row.get("value") or 0),
-                })
 
-        return {
-            "rule": rule_text, "rule_type": rule_type,
-            "fund_id": fund_id, "as_of_date": as_of_date,
-            "passed": passed,
-            "metric_value": round(equity_weight, 4),
-            "threshold": threshold, "unit": "% of NAV",
-            "breaches": breaches,
-            "message": (
-                f"Equity exposure is {equity_weight:.2f}% of portfolio, "
-                f"{'within' if passed else 'exceeds'} max {threshold}%."
-            ),
-        }
-    except Exception as e:
-        return _error(rule_text, rule_type, fund_id, as_of_date, threshold, "% of NAV", e)
+# ---------------------------------------------------------------------------
+# Aggregation kernels — compiled with numba when it is installed
+# ---------------------------------------------------------------------------
 
+if HAVE_NUMBA:
+    # Room for each group's partials. They are non-overlapping and no two
+    # neighbours fit in one float, so binary64's 2098-bit range holds fewer
+    # than 2 * 2098 / 53 = 80 of them; weights in practice need one to three.
+    _MAX_PARTIALS = 128
 
-def check_no_restricted_positions(fund_id: str, as_of_date: str, threshold: int = 0) -> dict:
+    @njit(cache=True)
+    def _partials_add(partials, counts, code, x):
+        """
+        Add x to group code's partials — one step of Shewchuk's exact
+        summation, the algorithm behind math.fsum.
+        """
+        p = partials[code]
+        j = 0
+        for k in range(counts[code]):
+            y = p[k]
+            if abs(x) < abs(y):
+                x, y = y, x
+            hi = x + y
+            lo = y - (hi - x)
+            if lo != 0.0:
+                p[j] = lo
+                j += 1
+            x = hi
+        if x != 0.0:
+            p[j] = x
+            j += 1
+        counts[code] = j
+
+    @njit(cache=True)
+    def _partials_total(p, n):
+        """Round exact partials to the nearest float, as math.fsum does (half-even across partials)."""
+        hi = 0.0
+        lo = 0.0
+        if n > 0:
+            n -= 1
+            hi = p[n]
+            while n > 0:
+                x = hi
+                n -= 1
+                y = p[n]
+                hi = x + y
+                lo = y - (hi - x)
+                if lo != 0.0:
+                    break
+            if n > 0 and ((lo < 0.0 and p[n - 1] < 0.0) or (lo > 0.0 and p[n - 1] > 0.0)):
+                y = lo * 2.0
+                x = hi + y
+                if y == x - hi:
+                    hi = x
+        return hi
+
+    @njit(cache=True)
+    def _totals(partials, counts):
+        out = np.empty(counts.shape[0])
+        for g in range(counts.shape[0]):
+            out[g] = _partials_total(partials[g], counts[g])
+        return out
+
+    @njit(cache=True)
+    def _numba_fund_aggregates(weights, country_codes, n_country, sector_codes, n_sector,
+                               asset_class_codes, n_asset_class):
+        """
+        Per-country, per-sector and per-asset-class weight totals in a single
+        pass over the positions, each correctly rounded — bit-for-bit what
+        math.fsum gives, so both kernel paths and the per-rule sums agree.
+        """
+        country_p, country_n = np.empty((n_country, _MAX_PARTIALS)), np.zeros(n_country, np.int64)
+        sector_p, sector_n = np.empty((n_sector, _MAX_PARTIALS)), np.zeros(n_sector, np.int64)
+        asset_class_p, asset_class_n = np.empty((n_asset_class, _MAX_PARTIALS)), np.zeros(n_asset_class, np.int64)
+        for i in range(weights.shape[0]):
+            _partials_add(country_p, country_n, country_codes[i], weights[i])
+            _partials_add(sector_p, sector_n, sector_codes[i], weights[i])
+            _partials_add(asset_class_p, asset_class_n, asset_class_codes[i], weights[i])
+        return (_totals(country_p, country_n), _totals(sector_p, sector_n),
+                _totals(asset_class_p, asset_class_n))
+
+
+def _group_totals(weights: np.ndarray, codes: np.ndarray, n_groups: int) -> np.ndarray:
     """
-    Rule: no positions with Restricted compliance status
-    Rule type: PROHIBITED
+    Weight total per code. np.bincount sizes the groups, then each group's
+    contiguous run (after a stable sort by code) is summed with math.fsum —
+    a plain np.bincount(weights=...) sum drifts by an ulp from the correctly
+    rounded total and shows up in the breach sheets.
     """
-    rule_text = "no positions with Restricted compliance status"
-    rule_type = "PROHIBITED"
-    try:
-        # text2sql: "Count of positions with compliance_status = Restricted for a given fund"
-        sql_count = f"""
-            SELECT COUNT(*) AS restricted_count
-            FROM positions
-            WHERE fund_id = {fund_id}
-              AND compliance_status = 'Restricted'
-        """
-        df = execute_sql(sql_count)
-        count = int(df.iloc[0, 0]) if not df.empty and df.iloc[0, 0] is not None else 0
-        passed = count == 0
-
-        breaches = []
-        if not passed:
-            sql_breach = f"""
-                SELECT isin AS identifier, security_name AS description, weight_pct AS value
-                FROM positions
-                WHERE fund_id = {fund_id}
-                  AND compliance_status = 'Restricted'
-                ORDER BY weight_pct DESC
-            """
-            df_b = execute_sql(sql_breach)
-            for _, row in df_b.iterrows():
-                breaches.append({
-                    "identifier": str(row.get("identifier") or ""),
-                    "description": str(row.get("description") or ""),
-                    "value": float(row.get("value") or 0),
-                })
+    ends = np.cumsum(np.bincount(codes, minlength=n_groups))
+    runs = np.split(weights[np.argsort(codes, kind="stable")], ends)[:-1]
+    return np.array([math.fsum(run) for run in runs], dtype=np.float64)
+
+
+def _numpy_fund_aggregates(weights, country_codes, n_country, sector_codes, n_sector,
+                           asset_class_codes, n_asset_class):
+    """Per-country, per-sector and per-asset-class weight totals, vectorised with numpy."""
+    return (_group_totals(weights, country_codes, n_country),
+            _group_totals(weights, sector_codes, n_sector),
+            _group_totals(weights, asset_class_codes, n_asset_class))
 
-        return {
-            "rule": rule_text, "rule_type": rule_type,
-            "fund_id": fund_id, "as_of_date": as_of_date,
-            "passed": passed,
-            "metric_value": count, "threshold": threshold, "unit": "count",
-            "breaches": breaches,
-            "message": (
-                "No Restricted positions found." if passed
-                else f"{count} Restricted position(s) found — rule breached."
-            ),
-        }
-    except Exception as e:
-        return _error(rule_text, rule_type, fund_id, as_of_date, threshold, "count", e)
 
+_FUND_AGGREGATES = None  # chosen on the first fund_aggregates call
 
-def check_max_single_country_concentration(fund_id: str, as_of_date: str, threshold: float = 30.0) -> dict:
+
+def fund_aggregates(weights, country_codes, n_country, sector_codes, n_sector,
+                    asset_class_codes, n_asset_class) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
     """
-    Rule: max 30% of portfolio in any single country
-    Rule type: CONCENTRATION
+    Per-country, per-sector and per-asset-class weight totals. The numba
+    kernel is compiled (or loaded from numba's on-disk cache) on the first
+    call rather than at import; if that fails — e.g. the cache was written
+    while this file was imported under another module name — the numpy path
+    serves the rest of the run.
     """
-    rule_text = "max 30% of portfolio in any single country"
-    rule_type = "CONCENTRATION"
-    try:
-        # text2sql: "Sum of weight_pct grouped by country for a given fund, ordered descending"
-        sql = f"""
-            SELECT country, SUM(weight_pct) AS country_weight
-            FROM positions
-            WHERE fund_id = {fund_id}
-            GROUP BY country
-            ORDER BY country_weight DESC
-        """
-        df = execute_sql(sql)
-        if df.empty:
-            return _pass(rule_text, rule_type, fund_id, as_of_date, 0.0, threshold, "% of NAV",
-                         "No positions found.")
+    global _FUND_AGGREGATES
+    args = (weights, country_codes, n_country, sector_codes, n_sector, asset_class_codes, n_asset_class)
+    if _FUND_AGGREGATES is None:
+        _FUND_AGGREGATES = _numpy_fund_aggregates
+        if HAVE_NUMBA:
+            try:
+                totals = _numba_fund_aggregates(*args)
+            except Exception as exc:
+                print(f"  [WARN] numba kernel unavailable ({type(exc).__name__}: {exc}) — using numpy")
+            else:
+                _FUND_AGGREGATES = _numba_fund_aggregates
+                return totals
+    return _FUND_AGGREGATES(*args)
 
-        max_weight = float(df.iloc[0]["country_weight"])
-        passed = max_weight <= threshold
 
-        breaches = []
-        if not passed:
-            breaching = df[df["country_weight"] > threshold]
-            for _, row in breaching.iterrows():
-                breaches.append({
-                    "identifier": str(row["country"]),
-                    "description": f"Country: {row['country']}",
-                    "value": float(row["country_weight"]),
-                })
+def _sorted_totals(sums: np.ndarray, labels: pd.Index) -> pd.Series:
+    """Group totals as a Series ordered largest-first (ties keep label order)."""
+    return pd.Series(sums, index=labels).sort_values(ascending=False, kind="stable")
 
-        return {
-            "rule": rule_text, "rule_type": rule_type,
-            "fund_id": fund_id, "as_of_date": as_of_date,
-            "passed": passed,
-            "metric_value": round(max_weight, 4), "threshold": threshold, "unit": "% of NAV",
-            "breaches": breaches,
-            "message": (
-                f"Max country concentration is {max_weight:.2f}% ({df.iloc[0]['country']}), "
-                f"{'within' if passed else 'exceeds'} max {threshold}%."
-            ),
-        }
-    except Exception as e:
-        return _error(rule_text, rule_type, fund_id, as_of_date, threshold, "% of NAV", e)
 
+# ---------------------------------------------------------------------------
+# Fund metrics — one scan of positions per fund, shared by every rule check
+# ---------------------------------------------------------------------------
 
-def check_max_single_sector_concentration(fund_id: str, as_of_date: str, threshold: float = 30.0) -> dict:
-    """
-    Rule: max 30% of portfolio in any single sector
-    Rule type: CONCENTRATION
-    """
-    rule_text = "max 30% of portfolio in any single sector"
-    rule_type = "CONCENTRATION"
-    try:
-        # text2sql: "Sum of weight_pct grouped by sector for a given fund, ordered descending"
-        sql = f"""
-            SELECT sector, SUM(weight_pct) AS sector_weight
-            FROM positions
-            WHERE fund_id = {fund_id}
-            GROUP BY sector
-            ORDER BY sector_weight DESC
-        """
-        df = execute_sql(sql)
-        if df.empty:
-            return _pass(rule_text, rule_type, fund_id, as_of_date, 0.0, threshold, "% of NAV",
-                         "No positions found.")
+_BREACH_COLUMNS = {"isin": "identifier", "security_name": "description", "weight_pct": "value"}
 
-        max_weight = float(df.iloc[0]["sector_weight"])
-        passed = max_weight <= threshold
+_METRICS_CACHE: dict[tuple, dict] = {}
+_METRICS_LOCK = threading.Lock()
 
-        breaches = []
-        if not passed:
-            breaching = df[df["sector_weight"] > threshold]
-            for _, row in breaching.iterrows():
-                breaches.append({
-                    "identifier": str(row["sector"]),
-                    "description": f"Sector: {row['sector']}",
-                    "value": float(row["sector_weight"]),
-                })
+# Constant SQL text with a bound fund_id, so sqlite3's statement cache reuses
+# the compiled plan for every fund instead of re-parsing an interpolated query.
+_POSITIONS_SQL = """
+    SELECT isin, security_name, asset_class, country, sector,
+           compliance_status, weight_pct
+    FROM positions
+    WHERE fund_id = ?
+    ORDER BY weight_pct DESC  -- read off idx_positions_fund_weight, no sort step
+"""
 
-        return {
-            "rule": rule_text, "rule_type": rule_type,
-            "fund_id": fund_id, "as_of_date": as_of_date,
-            "passed": passed,
-            "metric_value": round(max_weight, 4), "threshold": threshold, "unit": "% of NAV",
-            "breaches": breaches,
-            "message": (
-                f"Max sector concentration is {max_weight:.2f}% ({df.iloc[0]['sector']}), "
-                f"{'within' if passed else 'exceeds'} max {threshold}%."
-            ),
-        }
-    except Exception as e:
-        return _error(rule_text, rule_type, fund_id, as_of_date, threshold, "% of NAV", e)
+# Low-cardinality dimensions as categoricals: predicates compare integer codes
+# and the aggregation kernel reads .cat.codes directly (categories are sorted,
+# so group ties still break by label). weight_pct stays float64 — float32
+# would shift sums enough to flip results sitting right at a threshold.
+_POSITIONS_DTYPES = {
+    "asset_class": "category",
+    "country": "category",
+    "sector": "category",
+    "compliance_status": "category",
+    "weight_pct": "float64",
+}
 
 
-def check_max_bond_exposure(fund_id: str, as_of_date: str, threshold: float = 40.0) -> dict:
+def _load_fund_metrics(fund_id: str, as_of_date: str) -> dict:
     """
-    Rule: max 40% of portfolio in Bonds
-    Rule type: MAX_PCT_NAV
-    Term resolution: "Bonds" = positions with asset_class = 'Bond'
-    """
-    rule_text = "max 40% of portfolio in Bonds"
-    rule_type = "MAX_PCT_NAV"
-    try:
-        sql = f"""
-            SELECT SUM(weight_pct) AS bond_weight
-            FROM positions
-            WHERE fund_id = {fund_id}
-              AND asset_class = 'Bond'
-        """
-        df = execute_sql(sql)
-        bond_weight = float(df.iloc[0, 0]) if not df.empty and df.iloc[0, 0] is not None else 0.0
-        passed = bond_weight <= threshold
-
-        breaches = []
-        if not passed:
-            sql_breach = f"""
-                SELECT isin AS identifier, security_name AS description, weight_pct AS value
-                FROM positions
-                WHERE fund_id = {fund_id}
-                  AND asset_class = 'Bond'
-                ORDER BY weight_pct DESC
-            """
-            df_b = execute_sql(sql_breach)
-            for _, row in df_b.iterrows():
-                breaches.append({
-                    "identifier": str(row.get("identifier") or ""),
-                    "description": str(row.get("description") or ""),
-                    "value": float(row.get("value") or 0),
-                })
+    Load the fund's positions once and pre-aggregate everything the rule
+    checks need. Cached per (fund_id, as_of_date) until portfolio.db changes;
+    entries for an older db version are dropped on the next load, and the
+    oldest are evicted once METRICS_CACHE_SIZE funds are held. Positions come
+    back largest-first, so every top-k the rules need is a prefix slice.
 
-        return {
-            "rule": rule_text, "rule_type": rule_type,
-            "fund_id": fund_id, "as_of_date": as_of_date,
-            "passed": passed,
-            "metric_value": round(bond_weight, 4), "threshold": threshold, "unit": "% of NAV",
-            "breaches": breaches,
-            "message": (
-                f"Bond exposure is {bond_weight:.2f}% of portfolio, "
-                f"{'within' if passed else 'exceeds'} max {threshold}%."
-            ),
+    text2sql: "All positions for a given fund with their weight_pct, ordered by weight descending"
+    NOTE: as_of_date not stored in schema; all positions are current snapshot.
+    """
+    key = (fund_id, as_of_date, _db_version())
+    # Held across the load so concurrent rule checks wait for one scan
+    with _METRICS_LOCK:
+        metrics = _METRICS_CACHE.get(key)
+        if metrics is not None:
+            return metrics
+
+        positions = execute_sql(_POSITIONS_SQL, (fund_id,), dtype=_POSITIONS_DTYPES)
+        weights = positions["weight_pct"].to_numpy()
+        country, sector = positions["country"].cat, positions["sector"].cat
+        asset_class = positions["asset_class"].cat
+        # All three are NOT NULL, so every code is a valid index
+        country_sums, sector_sums, asset_class_sums = fund_aggregates(
+            weights,
+            country.codes.to_numpy(), len(country.categories),
+            sector.codes.to_numpy(), len(sector.categories),
+            asset_class.codes.to_numpy(), len(asset_class.categories),
+        )
+        status = positions["compliance_status"]
+        metrics = {
+            "positions": positions,
+            "position_count": len(positions),
+            "weights": weights,
+            "by_country": _sorted_totals(country_sums, country.categories),
+            "by_sector": _sorted_totals(sector_sums, sector.categories),
+            # Shared by the status rules' metric and breach filters
+            "is_restricted": (status == "Restricted").to_numpy(),
+            "is_review": (status == "Review").to_numpy(),
+            # Column arrays and per-class totals for the asset-class rules (see _eval_pct)
+            "asset_class_codes": asset_class.codes.to_numpy(),
+            "asset_class_sums": asset_class_sums,
+            "asset_class_index": {name: code for code, name in enumerate(asset_class.categories)},
         }
-    except Exception as e:
-        return _error(rule_text, rule_type, fund_id, as_of_date, threshold, "% of NAV", e)
+        for stale in [k for k in _METRICS_CACHE if k[2] != key[2]]:
+            del _METRICS_CACHE[stale]
+        if len(_METRICS_CACHE) >= METRICS_CACHE_SIZE:
+            del _METRICS_CACHE[next(iter(_METRICS_CACHE))]
+        _METRICS_CACHE[key] = metrics
+    return metrics
 
 
-def check_min_cash_exposure(fund_id: str, as_of_date: str, threshold: float = 2.0) -> dict:
-    """
-    Rule: min 2% of portfolio in Cash
-    Rule type: MIN_PCT_NAV
-    Term resolution: "Cash" = positions with asset_class = 'Cash'
-    """
-    rule_text = "min 2% of portfolio in Cash"
-    rule_type = "MIN_PCT_NAV"
-    try:
-        sql = f"""
-            SELECT SUM(weight_pct) AS cash_weight
-            FROM positions
-            WHERE fund_id = {fund_id}
-              AND asset_class = 'Cash'
-        """
-        df = execute_sql(sql)
-        cash_weight = float(df.iloc[0, 0]) if not df.empty and df.iloc[0, 0] is not None else 0.0
-        passed = cash_weight >= threshold
-
-        return {
-            "rule": rule_text, "rule_type": rule_type,
-            "fund_id": fund_id, "as_of_date": as_of_date,
-            "passed": passed,
-            "metric_value": round(cash_weight, 4), "threshold": threshold, "unit": "% of NAV",
-            "breaches": [],
-            "message": (
-                f"Cash is {cash_weight:.2f}% of portfolio, "
-                f"{'meets' if passed else 'below'} minimum {threshold}%."
-            ),
-        }
-    except Exception as e:
-        return _error(rule_text, rule_type, fund_id, as_of_date, threshold, "% of NAV", e)
+def _breakdown(positions: pd.DataFrame, rows) -> pd.DataFrame:
+    """Position-level breach detail (identifier, description, value) for the selected rows."""
+    return positions.loc[rows, list(_BREACH_COLUMNS)].rename(columns=_BREACH_COLUMNS)
 
 
-def check_max_single_position_weight(fund_id: str, as_of_date: str, threshold: float = 15.0) -> dict:
-    """
-    Rule: no single position to exceed 15% of NAV
-    Rule type: CONCENTRATION
-    """
-    rule_text = "no single position to exceed 15% of NAV"
-    rule_type = "CONCENTRATION"
-    try:
-        # text2sql: "All positions for a given fund with their weight_pct, ordered by weight descending"
-        sql = f"""
-            SELECT isin AS identifier, security_name AS description, weight_pct AS value
-            FROM positions
-            WHERE fund_id = {fund_id}
-            ORDER BY weight_pct DESC
-        """
-        df = execute_sql(sql)
-        if df.empty:
-            return _pass(rule_text, rule_type, fund_id, as_of_date, 0.0, threshold, "% of NAV",
-                         "No positions found.")
+def _asset_class_targets(metrics: dict, names: tuple[str, ...]) -> np.ndarray:
+    """Category codes of the named asset classes present in the fund (same dtype as the codes)."""
+    index = metrics["asset_class_index"]
+    return np.array([index[name] for name in names if name in index],
+                    dtype=metrics["asset_class_codes"].dtype)
 
-        max_weight = float(df.iloc[0]["value"])
-        passed = max_weight <= threshold
 
-        breaches = []
-        if not passed:
-            breaching = df[df["value"] > threshold]
-            for _, row in breaching.iterrows():
-                breaches.append({
-                    "identifier": str(row.get("identifier") or ""),
-                    "description": str(row.get("description") or ""),
-                    "value": float(row.get("value") or 0),
-                })
+def _asset_class_mask(metrics: dict, names: tuple[str, ...]) -> np.ndarray:
+    """Positions whose asset_class is one of names, compared on category codes."""
+    return np.isin(metrics["asset_class_codes"], _asset_class_targets(metrics, names))
 
-        return {
-            "rule": rule_text, "rule_type": rule_type,
-            "fund_id": fund_id, "as_of_date": as_of_date,
-            "passed": passed,
-            "metric_value": round(max_weight, 4), "threshold": threshold, "unit": "% of NAV",
-            "breaches": breaches,
-            "message": (
-                f"Largest position is {max_weight:.2f}% ({df.iloc[0]['description']}), "
-                f"{'within' if passed else 'exceeds'} max {threshold}%."
-            ),
-        }
-    except Exception as e:
-        return _error(rule_text, rule_type, fund_id, as_of_date, threshold, "% of NAV", e)
 
+def _count_above(sorted_desc: np.ndarray, threshold: float) -> int:
+    """Number of leading entries above threshold in an array sorted descending."""
+    return int(np.searchsorted(-sorted_desc, -threshold, side="left"))
 
-def check_max_review_status_exposure(fund_id: str, as_of_date: str, threshold: float = 20.0) -> dict:
-    """
-    Rule: max 20% of portfolio in Review status positions
-    Rule type: MAX_PCT_NAV
-    """
-    rule_text = "max 20% of portfolio in Review status positions"
-    rule_type = "MAX_PCT_NAV"
-    try:
-        sql = f"""
-            SELECT SUM(weight_pct) AS review_weight
-            FROM positions
-            WHERE fund_id = {fund_id}
-              AND compliance_status = 'Review'
-        """
-        df = execute_sql(sql)
-        review_weight = float(df.iloc[0, 0]) if not df.empty and df.iloc[0, 0] is not None else 0.0
-        passed = review_weight <= threshold
-
-        breaches = []
-        if not passed:
-            sql_breach = f"""
-                SELECT isin AS identifier, security_name AS description, weight_pct AS value
-                FROM positions
-                WHERE fund_id = {fund_id}
-                  AND compliance_status = 'Review'
-                ORDER BY weight_pct DESC
-            """
-            df_b = execute_sql(sql_breach)
-            for _, row in df_b.iterrows():
-                breaches.append({
-                    "identifier": str(row.get("identifier") or ""),
-                    "description": str(row.get("description") or ""),
-                    "value": float(row.get("value") or 0),
-                })
 
-        return {
-            "rule": rule_text, "rule_type": rule_type,
-            "fund_id": fund_id, "as_of_date": as_of_date,
-            "passed": passed,
-            "metric_value": round(review_weight, 4), "threshold": threshold, "unit": "% of NAV",
-            "breaches": breaches,
-            "message": (
-                f"Review-status positions are {review_weight:.2f}% of portfolio, "
-                f"{'within' if passed else 'exceeds'} max {threshold}%."
-            ),
-        }
-    except Exception as e:
-        return _error(rule_text, rule_type, fund_id, as_of_date, threshold, "% of NAV", e)
+def _breach_records(df_b: pd.DataFrame) -> list[dict]:
+    """Convert an identifier/description/value frame to breach dicts in one vectorized pass."""
+    return pd.DataFrame({
+        "identifier": df_b["identifier"].fillna("").astype(str),
+        "description": df_b["description"].fillna("").astype(str),
+        "value": df_b["value"].fillna(0).astype(float),
+    }).to_dict("records")
 
 
-def check_max_commodity_exposure(fund_id: str, as_of_date: str, threshold: float = 15.0) -> dict:
-    """
-    Rule: max 15% of portfolio in Commodity
-    Rule type: MAX_PCT_NAV
-    Term resolution: "Commodity" = positions with asset_class = 'Commodity'
-    """
-    rule_text = "max 15% of portfolio in Commodity"
-    rule_type = "MAX_PCT_NAV"
-    try:
-        sql = f"""
-            SELECT SUM(weight_pct) AS commodity_weight
-            FROM positions
-            WHERE fund_id = {fund_id}
-              AND asset_class = 'Commodity'
-        """
-        df = execute_sql(sql)
-        commodity_weight = float(df.iloc[0, 0]) if not df.empty and df.iloc[0, 0] is not None else 0.0
-        passed = commodity_weight <= threshold
-
-        breaches = []
-        if not passed:
-            sql_breach = f"""
-                SELECT isin AS identifier, security_name AS description, weight_pct AS value
-                FROM positions
-                WHERE fund_id = {fund_id}
-                  AND asset_class = 'Commodity'
-                ORDER BY weight_pct DESC
-            """
-            df_b = execute_sql(sql_breach)
-            for _, row in df_b.iterrows():
-                breaches.append({
-                    "identifier": str(row.get("identifier") or ""),
-                    "description": str(row.get("description") or ""),
-                    "value": float(row.get("value") or 0),
-                })
+# ---------------------------------------------------------------------------
+# Generated compliance rules
+# (SQL authored at generation time via compliance-rule-generator skill,
+#  adapted to the portfolio.db schema: funds + positions tables, and folded
+#  into the single positions scan in _load_fund_metrics. Each rule is now
+#  data — a RuleSpec — evaluated by one of a few generic evaluators.
+#  NAV basis: funds.aum_usd (millions); weight basis: positions.weight_pct)
+# ---------------------------------------------------------------------------
 
-        return {
-            "rule": rule_text, "rule_type": rule_type,
-            "fund_id": fund_id, "as_of_date": as_of_date,
-            "passed": passed,
-            "metric_value": round(commodity_weight, 4), "threshold": threshold, "unit": "% of NAV",
-            "breaches": breaches,
-            "message": (
-                f"Commodity exposure is {commodity_weight:.2f}% of portfolio, "
-                f"{'within' if passed else 'exceeds'} max {threshold}%."
-            ),
-        }
-    except Exception as e:
-        return _error(rule_text, rule_type, fund_id, as_of_date, threshold, "% of NAV", e)
+RuleKind = Literal["MAX_PCT", "MIN_PCT", "MAX_COUNT", "MIN_COUNT",
+                   "CONC_GROUP", "CONC_POSITION", "CONC_TOPN"]
 
 
-def check_max_equity_etf_combined(fund_id: str, as_of_date: str, threshold: float = 50.0) -> dict:
+@dataclass(frozen=True)
+class RuleSpec:
     """
-    Rule: max 50% of portfolio in Equity plus ETF combined
-    Rule type: MAX_PCT_NAV
-    Term resolution: "Equity plus ETF" = asset_class IN ('Equity', 'ETF')
+    One generated compliance rule.
+
+    kind       — which evaluator runs it; MIN_* kinds pass when the metric is
+                 >= threshold, all others when it is <= threshold
+    asset_classes — positions.asset_class values in scope (MAX_PCT / MIN_PCT);
+                 read off the per-class totals of the fused scan
+    predicate  — fund metrics -> numpy boolean mask over metrics["positions"] of
+                 the positions in scope, for any other filter (MAX_PCT / MIN_PCT /
+                 MAX_COUNT; None = all)
+    group_by   — positions column to aggregate by (CONC_GROUP)
+    topn       — number of largest holdings to sum (CONC_TOPN)
+    message    — str.format template; fields: value, verdict, threshold, top
+    zero_message — replaces message when the rule passes with a metric of 0, if set
     """
-    rule_text = "max 50% of portfolio in Equity plus ETF combined"
-    rule_type = "MAX_PCT_NAV"
-    try:
-        sql = f"""
-            SELECT SUM(weight_pct) AS equity_etf_weight
-            FROM positions
-            WHERE fund_id = {fund_id}
-              AND asset_class IN ('Equity', 'ETF')
-        """
-        df = execute_sql(sql)
-        combined_weight = float(df.iloc[0, 0]) if not df.empty and df.iloc[0, 0] is not None else 0.0
-        passed = combined_weight <= threshold
-
-        breaches = []
-        if not passed:
-            sql_breach = f"""
-                SELECT isin AS identifier, security_name AS description, weight_pct AS value
-                FROM positions
-                WHERE fund_id = {fund_id}
-                  AND asset_class IN ('Equity', 'ETF')
-                ORDER BY weight_pct DESC
-            """
-            df_b = execute_sql(sql_breach)
-            for _, row in df_b.iterrows():
-                breaches.append({
-                    "identifier": str(row.get("identifier") or ""),
-                    "description": str(row.get("description") or ""),
-                    "value": float(row.get("value") or 0),
-                })
-
-        return {
-            "rule": rule_text, "rule_type": rule_type,
-            "fund_id": fund_id, "as_of_date": as_of_date,
-            "passed": passed,
-            "metric_value": round(combined_weight, 4), "threshold": threshold, "unit": "% of NAV",
-            "breaches": breaches,
-            "message": (
-                f"Equity+ETF combined is {combined_weight:.2f}% of portfolio, "
-                f"{'within' if passed else 'exceeds'} max {threshold}%."
-            ),
-        }
-    except Exception as e:
-        return _error(rule_text, rule_type, fund_id, as_of_date, threshold, "% of NAV", e)
+    rule_text: str
+    rule_type: str
+    kind: RuleKind
+    threshold: float
+    message: str
+    predicate: Callable[[dict], np.ndarray] | None = None
+    asset_classes: tuple[str, ...] | None = None
+    group_by: str | None = None
+    topn: int | None = None
+    zero_message: str | None = None
+
+    @property
+    def unit(self) -> str:
+        return "count" if self.kind.endswith("_COUNT") else "% of NAV"
+
+    @property
+    def is_minimum(self) -> bool:
+        return self.kind.startswith("MIN_")
+
+
+def _eval_pct(spec: RuleSpec, metrics: dict, threshold: float) -> tuple:
+    """MAX_PCT / MIN_PCT — total weight of the positions matching the predicate."""
+    # Every value is the correctly rounded sum of the weights in scope (math.fsum
+    # here and in fund_aggregates' exact partials), so rules agree on summation
+    weights = metrics["weights"]
+    mask = None
+    if spec.asset_classes is not None:
+        targets = _asset_class_targets(metrics, spec.asset_classes)
+        if len(targets) <= 1:
+            # A single class's total comes from the fused scan, so no mask is built here
+            value = float(metrics["asset_class_sums"][targets].sum())
+        else:
+            # Adding per-class totals would round twice
+            mask = _asset_class_mask(metrics, spec.asset_classes)
+            value = math.fsum(weights[mask])
+    elif spec.predicate is None:
+        # No filter: every position is in scope, as in _eval_count
+        mask = np.ones(len(weights), dtype=bool)
+        value = math.fsum(weights)
+    else:
+        mask = spec.predicate(metrics)
+        value = math.fsum(weights[mask])
+    passed = value >= threshold if spec.is_minimum else value <= threshold
+    if passed or spec.is_minimum:
+        return value, passed, [], None, 0
+    # Only a breach needs the positions themselves
+    if mask is None:
+        mask = _asset_class_mask(metrics, spec.asset_classes)
+    # Every position in scope counts as a breach; only the largest are listed
+    in_scope = np.flatnonzero(mask)
+    n = min(BREACH_DETAIL_LIMIT, _count_above(weights[in_scope], BREACH_DETAIL_MIN_WEIGHT))
+    breaches = _breach_records(_breakdown(metrics["positions"], in_scope[:n]))
+    return value, passed, breaches, None, len(in_scope)
+
+
+def _eval_count(spec: RuleSpec, metrics: dict, threshold: float) -> tuple:
+    """MAX_COUNT / MIN_COUNT — number of positions matching the predicate."""
+    positions = metrics["positions"]
+    if spec.predicate is None:
+        mask, value = positions.index, metrics["position_count"]
+    else:
+        mask = spec.predicate(metrics)
+        value = int(mask.sum())
+    passed = value >= threshold if spec.is_minimum else value <= threshold
+    if passed or spec.is_minimum:
+        return value, passed, [], None, 0
+    breaches = _breach_records(_breakdown(positions, mask))
+    return value, passed, breaches, None, len(breaches)
+
+
+def _eval_conc_group(spec: RuleSpec, metrics: dict, threshold: float) -> tuple:
+    """CONC_GROUP — largest total weight of any single group_by value."""
+    totals = metrics[f"by_{spec.group_by}"]
+    value = float(totals.iloc[0])
+    passed = value <= threshold
+    breaches = []
+    if not passed:
+        breaching = totals.iloc[:_count_above(totals.to_numpy(), threshold)]
+        names = breaching.index.astype(str)
+        breaches = _breach_records(pd.DataFrame({
+            "identifier": names,
+            "description": f"{spec.group_by.capitalize()}: " + names,
+            "value": breaching.to_numpy(),
+        }))
+    return value, passed, breaches, totals.index[0], len(breaches)
+
+
+def _eval_conc_position(spec: RuleSpec, metrics: dict, threshold: float) -> tuple:
+    """CONC_POSITION — weight of the largest single position."""
+    positions, weights = metrics["positions"], metrics["weights"]
+    value = float(weights[0])
+    passed = value <= threshold
+    breaches = []
+    if not passed:
+        breaching = positions.head(_count_above(weights, threshold))
+        breaches = _breach_records(_breakdown(breaching, breaching.index))
+    return value, passed, breaches, positions["security_name"].iloc[0], len(breaches)
+
+
+def _eval_conc_topn(spec: RuleSpec, metrics: dict, threshold: float) -> tuple:
+    """CONC_TOPN — combined weight of the topn largest positions."""
+    # Funds with fewer than topn positions just sum them all
+    value = math.fsum(metrics["weights"][:spec.topn])
+    passed = value <= threshold
+    breaches = []
+    if not passed:
+        top = metrics["positions"].head(spec.topn)
+        breaches = _breach_records(_breakdown(top, top.index))
+    return value, passed, breaches, None, len(breaches)
+
+
+# Each evaluator returns (value, passed, breaches, top, breach_count);
+# breach_count can exceed len(breaches) when only the detail is capped
+_EVALUATORS = {
+    "MAX_PCT": _eval_pct,
+    "MIN_PCT": _eval_pct,
+    "MAX_COUNT": _eval_count,
+    "MIN_COUNT": _eval_count,
+    "CONC_GROUP": _eval_conc_group,
+    "CONC_POSITION": _eval_conc_position,
+    "CONC_TOPN": _eval_conc_topn,
+}
 
 
-def check_min_position_count(fund_id: str, as_of_date: str, threshold: int = 10) -> dict:
-    """
-    Rule: minimum 10 positions in portfolio
-    Rule type: MAX_COUNT (inverted — minimum count)
-    """
-    rule_text = "minimum 10 positions in portfolio"
-    rule_type = "MAX_COUNT"
+def evaluate_rule(spec: RuleSpec, fund_id: str, as_of_date: str, threshold: float | None = None) -> dict:
+    """Run a RuleSpec against the fund's metrics and build the result dict."""
+    if threshold is None:
+        threshold = spec.threshold
     try:
-        sql = f"""
-            SELECT COUNT(*) AS position_count
-            FROM positions
-            WHERE fund_id = {fund_id}
-        """
-        df = execute_sql(sql)
-        count = int(df.iloc[0, 0]) if not df.empty and df.iloc[0, 0] is not None else 0
-        passed = count >= threshold
+        metrics = _load_fund_metrics(fund_id, as_of_date)
+        if spec.kind in ("CONC_GROUP", "CONC_POSITION") and metrics["position_count"] == 0:
+            return _pass(spec.rule_text, spec.rule_type, fund_id, as_of_date, 0.0, threshold, spec.unit,
+                         "No positions found.")
+
+        value, passed, breaches, top, breach_count = _EVALUATORS[spec.kind](spec, metrics, threshold)
+        if spec.unit != "count":
+            value = round(value, 4)
+        if spec.is_minimum:
+            verdict = "meets" if passed else "below"
+        else:
+            verdict = "within" if passed else "exceeds"
+        template = spec.zero_message if passed and value == 0 and spec.zero_message else spec.message
+        message = template.format(value=value, verdict=verdict, threshold=threshold, top=top)
+        if breach_count > len(breaches):
+            message += f" Breach detail lists the largest {len(breaches)} of {breach_count} positions."
 
         return {
-            "rule": rule_text, "rule_type": rule_type,
+            "rule": spec.rule_text, "rule_type": spec.rule_type,
             "fund_id": fund_id, "as_of_date": as_of_date,
             "passed": passed,
-            "metric_value": count, "threshold": threshold, "unit": "count",
-            "breaches": [],
-            "message": (
-                f"Portfolio has {count} positions, "
-                f"{'meets' if passed else 'below'} minimum of {threshold}."
-            ),
+            "metric_value": value, "threshold": threshold, "unit": spec.unit,
+            "breaches": breaches, "breach_count": breach_count,
+            "message": message,
         }
     except Exception as e:
-        return _error(rule_text, rule_type, fund_id, as_of_date, threshold, "count", e)
+        return _error(spec.rule_text, spec.rule_type, fund_id, as_of_date, threshold, spec.unit, e)
 
 
-def check_top5_holdings_concentration(fund_id: str, as_of_date: str, threshold: float = 80.0) -> dict:
-    """
-    Rule: top 5 holdings max 80% of portfolio
-    Rule type: CONCENTRATION
-    """
-    rule_text = "top 5 holdings max 80% of portfolio"
-    rule_type = "CONCENTRATION"
-    try:
-        # text2sql: "Sum of weight_pct of the 5 largest positions for a given fund"
-        sql = f"""
-            SELECT SUM(weight_pct) AS top5_weight
-            FROM (
-                SELECT weight_pct
-                FROM positions
-                WHERE fund_id = {fund_id}
-                ORDER BY weight_pct DESC
-                LIMIT 5
-            )
-        """
-        df = execute_sql(sql)
-        top5_weight = float(df.iloc[0, 0]) if not df.empty and df.iloc[0, 0] is not None else 0.0
-        passed = top5_weight <= threshold
-
-        breaches = []
-        if not passed:
-            sql_breach = f"""
-                SELECT isin AS identifier, security_name AS description, weight_pct AS value
-                FROM positions
-                WHERE fund_id = {fund_id}
-                ORDER BY weight_pct DESC
-                LIMIT 5
-            """
-            df_b = execute_sql(sql_breach)
-            for _, row in df_b.iterrows():
-                breaches.append({
-                    "identifier": str(row.get("identifier") or ""),
-                    "description": str(row.get("description") or ""),
-                    "value": float(row.get("value") or 0),
-                })
+# ---------------------------------------------------------------------------
+# Registry — maps rule_id to its generated rule
+# ---------------------------------------------------------------------------
 
-        return {
-            "rule": rule_text, "rule_type": rule_type,
-            "fund_id": fund_id, "as_of_date": as_of_date,
-            "passed": passed,
-            "metric_value": round(top5_weight, 4), "threshold": threshold, "unit": "% of NAV",
-            "breaches": breaches,
-            "message": (
-                f"Top 5 holdings represent {top5_weight:.2f}% of portfolio, "
-                f"{'within' if passed else 'exceeds'} max {threshold}%."
-            ),
-        }
-    except Exception as e:
-        return _error(rule_text, rule_type, fund_id, as_of_date, threshold, "% of NAV", e)
+RULE_REGISTRY = {
+    # "Equity" = asset_class 'Equity'; "% of NAV" = SUM(weight_pct) for the asset class
+    "R001": RuleSpec(
+        "max 60% of portfolio in Equity", "MAX_PCT_NAV", "MAX_PCT", 60.0,
+        "Equity exposure is {value:.2f}% of portfolio, {verdict} max {threshold}%.",
+        asset_classes=("Equity",),
+    ),
+    "R002": RuleSpec(
+        "no positions with Restricted compliance status", "PROHIBITED", "MAX_COUNT", 0,
+        "{value} Restricted position(s) found, {verdict} max {threshold}.",
+        predicate=lambda m: m["is_restricted"],
+        zero_message="No Restricted positions found.",
+    ),
+    "R003": RuleSpec(
+        "max 30% of portfolio in any single country", "CONCENTRATION", "CONC_GROUP", 30.0,
+        "Max country concentration is {value:.2f}% ({top}), {verdict} max {threshold}%.",
+        group_by="country",
+    ),
+    "R004": RuleSpec(
+        "max 30% of portfolio in any single sector", "CONCENTRATION", "CONC_GROUP", 30.0,
+        "Max sector concentration is {value:.2f}% ({top}), {verdict} max {threshold}%.",
+        group_by="sector",
+    ),
+    # "Bonds" = asset_class 'Bond'
+    "R005": RuleSpec(
+        "max 40% of portfolio in Bonds", "MAX_PCT_NAV", "MAX_PCT", 40.0,
+        "Bond exposure is {value:.2f}% of portfolio, {verdict} max {threshold}%.",
+        asset_classes=("Bond",),
+    ),
+    # "Cash" = asset_class 'Cash'
+    "R006": RuleSpec(
+        "min 2% of portfolio in Cash", "MIN_PCT_NAV", "MIN_PCT", 2.0,
+        "Cash is {value:.2f}% of portfolio, {verdict} minimum {threshold}%.",
+        asset_classes=("Cash",),
+    ),
+    "R007": RuleSpec(
+        "no single position to exceed 15% of NAV", "CONCENTRATION", "CONC_POSITION", 15.0,
+        "Largest position is {value:.2f}% ({top}), {verdict} max {threshold}%.",
+    ),
+    "R008": RuleSpec(
+        "max 20% of portfolio in Review status positions", "MAX_PCT_NAV", "MAX_PCT", 20.0,
+        "Review-status positions are {value:.2f}% of portfolio, {verdict} max {threshold}%.",
+        predicate=lambda m: m["is_review"],
+    ),
+    # "Commodity" = asset_class 'Commodity'
+    "R009": RuleSpec(
+        "max 15% of portfolio in Commodity", "MAX_PCT_NAV", "MAX_PCT", 15.0,
+        "Commodity exposure is {value:.2f}% of portfolio, {verdict} max {threshold}%.",
+        asset_classes=("Commodity",),
+    ),
+    # "Equity plus ETF" = asset_class IN ('Equity', 'ETF')
+    "R010": RuleSpec(
+        "max 50% of portfolio in Equity plus ETF combined", "MAX_PCT_NAV", "MAX_PCT", 50.0,
+        "Equity+ETF combined is {value:.2f}% of portfolio, {verdict} max {threshold}%.",
+        asset_classes=("Equity", "ETF"),
+    ),
+    # Reported as MAX_COUNT (inverted — minimum count)
+    "R011": RuleSpec(
+        "minimum 10 positions in portfolio", "MAX_COUNT", "MIN_COUNT", 10,
+        "Portfolio has {value} positions, {verdict} minimum of {threshold}.",
+    ),
+    "R012": RuleSpec(
+        "top 5 holdings max 80% of portfolio", "CONCENTRATION", "CONC_TOPN", 80.0,
+        "Top 5 holdings represent {value:.2f}% of portfolio, {verdict} max {threshold}%.",
+        topn=5,
+    ),
+}
 
 
 # ---------------------------------------------------------------------------
-# Registry — maps rule_id to the generated function
+# Rule compiler — fallback for rule_ids without a generated rule. Rule texts
+# in the generator's own phrasing (asset-class exposure, single country /
+# sector concentration, top-N holdings) compile to a RuleSpec once at load
+# time; anything else still needs the generator.
 # ---------------------------------------------------------------------------
 
-RULE_REGISTRY = {
-    "R001": check_max_equity_exposure,
-    "R002": check_no_restricted_positions,
-    "R003": check_max_single_country_concentration,
-    "R004": check_max_single_sector_concentration,
-    "R005": check_max_bond_exposure,
-    "R006": check_min_cash_exposure,
-    "R007": check_max_single_position_weight,
-    "R008": check_max_review_status_exposure,
-    "R009": check_max_commodity_exposure,
-    "R010": check_max_equity_etf_combined,
-    "R011": check_min_position_count,
-    "R012": check_top5_holdings_concentration,
+# Words rule texts use for each positions.asset_class value
+_ASSET_CLASS_NAMES = {
+    "equity": "Equity", "equities": "Equity",
+    "bond": "Bond", "bonds": "Bond",
+    "cash": "Cash",
+    "commodity": "Commodity", "commodities": "Commodity",
+    "etf": "ETF", "etfs": "ETF",
 }
 
+# One alternation with named groups, so each text is classified in a single
+# match; whichever group is set says which rule shape it is.
+RULE_RE = re.compile(
+    r"""^(?:
+        top\s+(?P<topn>\d+)\s+holdings\s+max\s+(?P<topn_pct>\d+(?:\.\d+)?)%\s+of\s+portfolio
+      | (?P<op>max|min)(?:imum)?\s+(?P<pct>\d+(?:\.\d+)?)%\s+of\s+portfolio\s+in\s+
+        (?: any\s+single\s+(?P<group>country|sector)
+          | (?P<targets>\w+(?:\s+plus\s+\w+)*)(?:\s+combined)? )
+    )$""",
+    re.IGNORECASE | re.VERBOSE,
+)
+
+
+def compile_rule(rule_text: str) -> RuleSpec | None:
+    """RuleSpec for a rule text in one of the RULE_RE shapes, or None if it isn't one."""
+    m = RULE_RE.match(rule_text.strip())
+    if m is None:
+        return None
+
+    if m["topn"]:
+        n = int(m["topn"])
+        return RuleSpec(
+            rule_text, "CONCENTRATION", "CONC_TOPN", float(m["topn_pct"]),
+            f"Top {n} holdings represent {{value:.2f}}% of portfolio, {{verdict}} max {{threshold}}%.",
+            topn=n,
+        )
+
+    is_max = m["op"].lower() == "max"
+    threshold = float(m["pct"])
+    if m["group"]:
+        if not is_max:
+            return None
+        group = m["group"].lower()
+        return RuleSpec(
+            rule_text, "CONCENTRATION", "CONC_GROUP", threshold,
+            f"Max {group} concentration is {{value:.2f}}% ({{top}}), {{verdict}} max {{threshold}}%.",
+            group_by=group,
+        )
+
+    names = [_ASSET_CLASS_NAMES.get(word.lower()) for word in re.split(r"\s+plus\s+", m["targets"], flags=re.IGNORECASE)]
+    if None in names:
+        return None
+    label = f"{'+'.join(names)} combined" if len(names) > 1 else f"{names[0]} exposure"
+    bound = "max" if is_max else "minimum"
+    return RuleSpec(
+        rule_text, "MAX_PCT_NAV" if is_max else "MIN_PCT_NAV", "MAX_PCT" if is_max else "MIN_PCT", threshold,
+        f"{label} is {{value:.2f}}% of portfolio, {{verdict}} {bound} {{threshold}}%.",
+        asset_classes=tuple(names),
+    )
+
+
 # ---------------------------------------------------------------------------
 # Helper functions
 # ---------------------------------------------------------------------------
@@ -666,6 +775,8 @@ def _error(rule_text, rule_type, fund_id, as_of_date, threshold, unit, exc):
         "threshold": threshold, "unit": unit, "breaches": [],
         "message": f"Error during rule check: {exc}",
         "error": True,
+        # Kept for --verbose, which appends the traceback (see _result_message)
+        "_exc": exc,
     }
 
 def _pass(rule_text, rule_type, fund_id, as_of_date, metric_value, threshold, unit, message):
@@ -682,93 +793,291 @@ def _pass(rule_text, rule_type, fund_id, as_of_date, metric_value, threshold, un
 # Step 1 — Read input Excel
 # ---------------------------------------------------------------------------
 
-def load_rules(input_path: str) -> list[dict]:
+def _read_rules_sheet(input_path: str) -> list[dict[str, str]]:
+    """
+    Parse the Rules sheet into one dict of cell texts per row (keyed by the
+    header row), reusing a sidecar (<input>.cache.json) for as long as
+    neither the workbook's mtime nor this script (see _code_version) changed.
+    """
+    cache_path = input_path + ".cache.json"
+    version = [_code_version(), os.stat(input_path).st_mtime_ns]
+    records = _read_json_sidecar(cache_path, version)
+    if records is not None:
+        return records
+
+    # read_only streams the sheet XML instead of building the full cell tree
+    wb = load_workbook(input_path, read_only=True, data_only=True)
+    try:
+        if "Rules" not in wb.sheetnames:
+            raise ValueError("Input file must contain a sheet named 'Rules'")
+        rows = wb["Rules"].iter_rows(values_only=True)
+        headers = next(rows, ())
+        records = [{h: _cell_text(v) for h, v in zip(headers, row) if h is not None}
+                   for row in rows if any(v is not None for v in row)]
+    finally:
+        wb.close()
+    _write_json_sidecar(cache_path, version, records)
+    return records
+
+
+@dataclass(slots=True)
+class NormalizedRule:
+    """One row of the Rules sheet, parsed once so run_rules only reads fixed slots."""
+    rule_id: str
+    enabled: bool
+    threshold_override: float | None
+    rule_text: str
+    category: str
+    notes: str
+    spec: RuleSpec | None  # resolved once here; None = no generated or compilable rule
+
+
+def _cell_text(value) -> str:
+    """Sheet cell as text; blank cells (NaN / None) become ""."""
+    return "" if value is None or pd.isna(value) else str(value)
+
+
+def _normalize_rule(record: dict) -> NormalizedRule:
+    # rule_id and category repeat on every summary/breach row built from this
+    # rule; interned, the output writers compare and hash them by identity
+    rule_id = sys.intern(_cell_text(record.get("rule_id")).strip())
+
+    threshold_override = None
+    override = _cell_text(record.get("threshold_override")).strip()
+    if override and override not in ("nan", "None"):
+        try:
+            threshold_override = float(override)
+        except ValueError:
+            print(f"  [WARN] Non-numeric threshold_override '{override}' for {rule_id} — using default")
+
+    rule_text = _cell_text(record.get("rule_text"))
+    return NormalizedRule(
+        rule_id=rule_id,
+        # Blank means enabled
+        enabled=(_cell_text(record.get("enabled")).strip().upper() or "TRUE") == "TRUE",
+        threshold_override=threshold_override,
+        rule_text=rule_text,
+        category=sys.intern(_cell_text(record.get("category"))),
+        notes=_cell_text(record.get("notes")),
+        spec=RULE_REGISTRY.get(rule_id) or compile_rule(rule_text),
+    )
+
+
+def load_rules(input_path: str) -> list[NormalizedRule]:
     if not os.path.exists(input_path):
         raise FileNotFoundError(f"Input file not found: {input_path}")
-    df = pd.read_excel(input_path, sheet_name="Rules", dtype=str)
-    if "Rules" not in pd.ExcelFile(input_path).sheet_names:
-        raise ValueError("Input file must contain a sheet named 'Rules'")
-    df["enabled"] = df.get("enabled", pd.Series(["TRUE"] * len(df))).fillna("TRUE").str.upper()
-    return df.to_dict("records")
+    return [_normalize_rule(record) for record in _read_rules_sheet(input_path)]
 
 
 # ---------------------------------------------------------------------------
 # Step 2+3 — Resolve and execute each rule
 # ---------------------------------------------------------------------------
 
-def run_rules(rules: list[dict], fund_id: str, as_of_date: str) -> tuple[list[dict], list[dict]]:
-    summary_rows = []
-    breach_rows = []
-
-    for rule in rules:
-        rule_id = str(rule.get("rule_id", "")).strip()
-        enabled = str(rule.get("enabled", "TRUE")).strip().upper()
-
-        if enabled != "TRUE":
-            summary_rows.append({
-                "rule_id": rule_id,
-                "rule_text": rule.get("rule_text", ""),
-                "category": rule.get("category", ""),
-                "status": "SKIPPED",
-                "metric_value": "",
-                "threshold": "",
-                "unit": "",
-                "message": "Rule disabled",
-                "breach_count": 0,
-                "notes": rule.get("notes", ""),
-            })
-            continue
+# Rule results from earlier run_rules calls in this process, keyed by
+# (fund_id, as_of_date, rule_id, rule text, threshold override, db version) —
+# the text matters for compiled rules, whose logic comes from it. Oldest
+# entries are evicted first once RESULT_CACHE_SIZE is reached.
+_RESULT_CACHE: dict[tuple, dict] = {}
+
+
+def _cache_result(key: tuple, result: dict):
+    if result.get("error"):
+        return  # errors may be transient (e.g. a locked database); retry next run
+    if len(_RESULT_CACHE) >= RESULT_CACHE_SIZE:
+        del _RESULT_CACHE[next(iter(_RESULT_CACHE))]
+    _RESULT_CACHE[key] = result
+
+
+def _code_version() -> int:
+    """The rule registry lives in this file, so its mtime identifies the rule logic."""
+    return os.stat(__file__).st_mtime_ns
+
+
+def _read_json_sidecar(path: str, version):
+    """
+    The payload _write_json_sidecar stored at path under this version, or None.
+    These caches are JSON rather than pickle: they can sit next to a workbook
+    on a shared drive, and loading one must never run code.
+    """
+    try:
+        with open(path, encoding="utf-8") as f:
+            cached = json.load(f)
+        if cached["version"] == version:
+            return cached["payload"]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass  # missing, unreadable or old-format — the caller starts cold
+    return None
+
+
+def _write_json_sidecar(path: str, version, payload):
+    try:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"version": version, "payload": payload}, f)
+    except OSError:
+        pass  # read-only location — recompute next run
+
+
+def _as_key(value):
+    """JSON turns the cache key's tuples (the key and its db version) into lists; turn them back."""
+    return tuple(_as_key(v) for v in value) if isinstance(value, list) else value
+
+
+def load_result_cache(path: str = RESULT_CACHE_PATH):
+    """
+    Seed the result cache from an earlier run's file, as long as it was
+    written by this version of the script. Entries keep their db version in
+    the key, so results for a since-changed portfolio.db are never matched.
+    """
+    entries = _read_json_sidecar(path, _code_version())
+    if entries is not None:
+        _RESULT_CACHE.update((_as_key(key), result) for key, result in entries)
 
-        func = RULE_REGISTRY.get(rule_id)
-        if func is None:
+
+def save_result_cache(path: str = RESULT_CACHE_PATH):
+    """Persist the entries valid for the current portfolio.db for the next run."""
+    version = _db_version()
+    # Results are plain dicts of str / float / int / lists; keys go as [key, result] pairs
+    entries = [[key, result] for key, result in _RESULT_CACHE.items() if key[-1] == version]
+    _write_json_sidecar(path, _code_version(), entries)
+
+
+def _call_rule(job: tuple) -> dict:
+    """Evaluate one generated rule in a worker thread; never raises."""
+    spec, kwargs = job
+    try:
+        return evaluate_rule(spec, **kwargs)
+    except Exception as exc:
+        # evaluate_rule records its own failures via _error; this only catches
+        # what escapes it. Either way the traceback is formatted for --verbose only.
+        return {
+            "passed": False, "error": True,
+            "metric_value": None, "threshold": None, "unit": "",
+            "breaches": [],
+            "message": f"Uncaught exception: {exc}",
+            "_exc": exc,
+        }
+
+
+def _result_message(result: dict, verbose: bool) -> str:
+    message = result.get("message", "")
+    exc = result.get("_exc")
+    if verbose and exc is not None:
+        message += "\n" + "".join(traceback.format_exception(type(exc), exc, exc.__traceback__))
+    return message
+
+
+class SummaryRow(NamedTuple):
+    """One Summary sheet row; field order is the sheet's column order."""
+    rule_id: str
+    rule_text: str
+    category: str
+    status: str
+    metric_value: float | int | str | None
+    threshold: float | int | str | None
+    unit: str
+    message: str
+    breach_count: int
+    notes: str
+
+
+class BreachRow(NamedTuple):
+    """One Breaches sheet row; field order is the sheet's column order."""
+    rule_id: str
+    rule_text: str
+    identifier: str
+    description: str
+    value: float | None
+    unit: str
+
+
+def _skipped_row(rule: NormalizedRule) -> SummaryRow:
+    return SummaryRow(rule.rule_id, rule.rule_text, rule.category, "SKIPPED",
+                      "", "", "", "Rule disabled", 0, rule.notes)
+
+
+def run_rules(rules: list[NormalizedRule], fund_id: str, as_of_date: str,
+              max_workers: int = DEFAULT_WORKERS,
+              verbose: bool = False) -> tuple[list[SummaryRow], list[BreachRow]]:
+    # Partition up front: disabled rules get their SKIPPED rows in bulk and
+    # never enter the resolve/dispatch path below.
+    enabled_rules, skipped_rules = [], []
+    for idx, rule in enumerate(rules):
+        (enabled_rules if rule.enabled else skipped_rules).append((idx, rule))
+
+    indexed_rows = [(idx, _skipped_row(rule)) for idx, rule in skipped_rules]
+
+    # Resolve every enabled rule first (warnings print in input order, cached
+    # results are reused), then run the rest concurrently — each worker
+    # thread reads through its own connection — and zip results back.
+    version = _db_version()
+    plan = []
+    for idx, rule in enabled_rules:
+        rule_id, spec = rule.rule_id, rule.spec
+        if spec is None:
             print(f"  [WARN] No generated function for rule_id '{rule_id}' — recording ERROR")
-            result = {
+            plan.append((idx, rule_id, rule, {
                 "passed": False, "error": True,
                 "metric_value": None, "threshold": None, "unit": "",
                 "breaches": [],
                 "message": f"No compliance function registered for rule_id '{rule_id}'",
-            }
+            }))
+            continue
+
+        kwargs = {"fund_id": fund_id, "as_of_date": as_of_date, "threshold": rule.threshold_override}
+        cached = _RESULT_CACHE.get((fund_id, as_of_date, rule_id, spec.rule_text, rule.threshold_override, version))
+        plan.append((idx, rule_id, rule, cached if cached is not None else (spec, kwargs)))
+
+    jobs = [job for _, _, _, job in plan if isinstance(job, tuple)]
+    if max_workers <= 1 or len(jobs) <= 1:
+        # Nothing to overlap — skip the pool's thread start-up and hand-off
+        results = map(_call_rule, jobs)
+    else:
+        pool_conns: list[sqlite3.Connection] = []
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(jobs)),
+                                initializer=_init_pool_worker, initargs=(pool_conns,)) as executor:
+            results = iter(executor.map(_call_rule, jobs))
+        # The worker threads are gone; don't leave their connections open until exit
+        _close_pool_conns(pool_conns)
+
+    # Collect every result first, then build both row lists in one pass each
+    resolved = []
+    for idx, rule_id, rule, job in plan:
+        if isinstance(job, tuple):
+            result = next(results)
+            _cache_result((fund_id, as_of_date, rule_id, job[0].rule_text, rule.threshold_override, version), result)
         else:
-            kwargs = {"fund_id": fund_id, "as_of_date": as_of_date}
-            override = rule.get("threshold_override", "")
-            if override and str(override).strip() not in ("", "nan", "None"):
-                try:
-                    kwargs["threshold"] = float(override)
-                except ValueError:
-                    print(f"  [WARN] Non-numeric threshold_override '{override}' for {rule_id} — using default")
-            try:
-                result = func(**kwargs)
-            except Exception as exc:
-                result = {
-                    "passed": False, "error": True,
-                    "metric_value": None, "threshold": None, "unit": "",
-                    "breaches": [],
-                    "message": f"Uncaught exception: {exc}\n{traceback.format_exc()}",
-                }
-
-        status = "ERROR" if result.get("error") else ("PASS" if result["passed"] else "FAIL")
-        summary_rows.append({
-            "rule_id": rule_id,
-            "rule_text": rule.get("rule_text", result.get("rule", "")),
-            "category": rule.get("category", ""),
-            "status": status,
-            "metric_value": result.get("metric_value"),
-            "threshold": result.get("threshold"),
-            "unit": result.get("unit", ""),
-            "message": result.get("message", ""),
-            "breach_count": len(result.get("breaches", [])),
-            "notes": rule.get("notes", ""),
-        })
-
-        for breach in result.get("breaches", []):
-            breach_rows.append({
-                "rule_id": rule_id,
-                "rule_text": rule.get("rule_text", result.get("rule", "")),
-                "identifier": breach.get("identifier", ""),
-                "description": breach.get("description", ""),
-                "value": breach.get("value"),
-                "unit": result.get("unit", ""),
-            })
+            result = job  # an error or cached result
+        resolved.append((idx, rule_id, rule, rule.rule_text or result.get("rule", ""), result))
+
+    indexed_rows.extend(
+        (idx, SummaryRow(
+            rule_id,
+            rule_text,
+            rule.category,
+            "ERROR" if result.get("error") else ("PASS" if result["passed"] else "FAIL"),
+            result.get("metric_value"),
+            result.get("threshold"),
+            result.get("unit", ""),
+            _result_message(result, verbose),
+            result.get("breach_count", len(result.get("breaches", []))),
+            rule.notes,
+        ))
+        for idx, rule_id, rule, rule_text, result in resolved
+    )
+    # Back into input order — skipped rows were set aside at the top
+    summary_rows = [row for _, row in sorted(indexed_rows, key=lambda pair: pair[0])]
+    breach_rows = [
+        BreachRow(
+            rule_id,
+            rule_text,
+            breach.get("identifier", ""),
+            breach.get("description", ""),
+            breach.get("value"),
+            result.get("unit", ""),
+        )
+        for _, rule_id, _, rule_text, result in resolved
+        for breach in result.get("breaches", [])
+    ]
 
     return summary_rows, breach_rows
 
@@ -777,83 +1086,345 @@ def run_rules(rules: list[dict], fund_id: str, as_of_date: str) -> tuple[list[di
 # Step 5 — Write output Excel
 # ---------------------------------------------------------------------------
 
-def write_output(output_path: str, summary_rows: list[dict], breach_rows: list[dict]):
-    wb = Workbook()
+SUMMARY_HEADER_COLOR = "1F4E79"
+BREACH_HEADER_COLOR = "C00000"
+STATUS_COLORS = {"PASS": "C6EFCE", "FAIL": "FFC7CE", "ERROR": "FFEB9C", "SKIPPED": "D9D9D9"}
+ZEBRA_COLORS = ("FFFFFF", "FFE7E7")
 
-    # ---- Summary sheet ----
-    ws = wb.active
-    ws.title = "Summary"
-
-    headers = ["rule_id", "rule_text", "category", "status",
-               "metric_value", "threshold", "unit", "message", "breach_count", "notes"]
-
-    header_fill = PatternFill("solid", fgColor="1F4E79")
-    header_font = Font(bold=True, color="FFFFFF")
-    status_fills = {
-        "PASS":    PatternFill("solid", fgColor="C6EFCE"),
-        "FAIL":    PatternFill("solid", fgColor="FFC7CE"),
-        "ERROR":   PatternFill("solid", fgColor="FFEB9C"),
-        "SKIPPED": PatternFill("solid", fgColor="D9D9D9"),
-    }
+SUMMARY_HEADERS = SummaryRow._fields
+BREACH_HEADERS = BreachRow._fields
+SUMMARY_STATUS_COL = SUMMARY_HEADERS.index("status")
 
-    for col, h in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=h)
-        cell.fill = header_fill
-        cell.font = header_font
+# openpyxl style objects, built once per process and shared by every workbook
+# (xlsxwriter formats belong to a workbook, so those are made per call)
+DEFAULT_FILL = PatternFill()
+HEADER_FONT = Font(bold=True, color="FFFFFF")
+SUMMARY_HEADER_FILL = PatternFill("solid", fgColor=SUMMARY_HEADER_COLOR)
+BREACH_HEADER_FILL = PatternFill("solid", fgColor=BREACH_HEADER_COLOR)
+STATUS_FILLS = {status: PatternFill("solid", fgColor=color) for status, color in STATUS_COLORS.items()}
+ZEBRA_FILLS = tuple(PatternFill("solid", fgColor=color) for color in ZEBRA_COLORS)
 
-    status_col_idx = headers.index("status") + 1
-    for row_idx, row in enumerate(summary_rows, 2):
-        for col, h in enumerate(headers, 1):
-            ws.cell(row=row_idx, column=col, value=row.get(h, ""))
-        status_cell = ws.cell(row=row_idx, column=status_col_idx)
-        status_cell.fill = status_fills.get(str(row.get("status", "")), PatternFill())
 
-    ws.freeze_panes = "A2"
-    for col in ws.columns:
-        max_len = max((len(str(cell.value or "")) for cell in col), default=10)
-        ws.column_dimensions[get_column_letter(col[0].column)].width = min(max_len + 4, 60)
+def _column_widths(headers: tuple[str, ...], rows: list[tuple]) -> list[int]:
+    """
+    Column widths from one pass over the rows with a running max: each
+    column's longest value (header included) + 4, capped at 60.
+    """
+    widths = [len(h) for h in headers]
+    for row in rows:
+        for i, v in enumerate(row):
+            widths[i] = max(widths[i], len(str(v or "")))
+    return [min(w + 4, 60) for w in widths]
 
-    # ---- Breaches sheet ----
-    ws_b = wb.create_sheet("Breaches")
-    b_headers = ["rule_id", "rule_text", "identifier", "description", "value", "unit"]
-    breach_header_fill = PatternFill("solid", fgColor="C00000")
-    breach_header_font = Font(bold=True, color="FFFFFF")
 
-    for col, h in enumerate(b_headers, 1):
-        cell = ws_b.cell(row=1, column=col, value=h)
-        cell.fill = breach_header_fill
-        cell.font = breach_header_font
+def _set_column_widths(ws, widths: list[int]):
+    for col, width in enumerate(widths, 1):
+        ws.column_dimensions[get_column_letter(col)].width = width
+
 
-    zebra_fills = [PatternFill("solid", fgColor="FFFFFF"), PatternFill("solid", fgColor="FFE7E7")]
+def _header_row(ws, headers: tuple[str, ...], fill: PatternFill, font: Font) -> list[WriteOnlyCell]:
+    cells = [WriteOnlyCell(ws, value=h) for h in headers]
+    for cell in cells:
+        cell.fill = fill
+        cell.font = font
+    return cells
+
+
+def _zebra_indexes(breach_rows: list[BreachRow]):
+    """Alternate 1, 0, 1, ... each time rule_id changes, so each rule's breaches share a band."""
     current_rule = None
     zebra_idx = 0
-    for row_idx, row in enumerate(breach_rows, 2):
-        if row["rule_id"] != current_rule:
-            current_rule = row["rule_id"]
+    for row in breach_rows:
+        if row.rule_id is not current_rule:  # rule_ids are interned at load
+            current_rule = row.rule_id
             zebra_idx = 1 - zebra_idx
-        fill = zebra_fills[zebra_idx]
-        for col, h in enumerate(b_headers, 1):
-            cell = ws_b.cell(row=row_idx, column=col, value=row.get(h, ""))
-            cell.fill = fill
+        yield zebra_idx
+
+
+def _write_output_xlsxwriter(output_path: str, summary_rows: list[SummaryRow], breach_rows: list[BreachRow]):
+    # constant_memory flushes each row once the next one starts, so rows are
+    # written strictly top to bottom. Strings are written as-is (no formula,
+    # URL or number conversion), matching the openpyxl backend.
+    wb = xlsxwriter.Workbook(output_path, {
+        "constant_memory": True,
+        "strings_to_formulas": False,
+        "strings_to_urls": False,
+    })
+
+    # ---- Summary sheet ----
+    ws = wb.add_worksheet("Summary")
+    header_fmt = wb.add_format({"bold": True, "font_color": "FFFFFF",
+                                "pattern": 1, "bg_color": SUMMARY_HEADER_COLOR})
+    status_fmts = {status: wb.add_format({"pattern": 1, "bg_color": color})
+                   for status, color in STATUS_COLORS.items()}
 
+    ws.freeze_panes(1, 0)
+    for col, width in enumerate(_column_widths(SUMMARY_HEADERS, summary_rows)):
+        ws.set_column(col, col, width)
+    ws.write_row(0, 0, SUMMARY_HEADERS, header_fmt)
+
+    for r, row in enumerate(summary_rows, 1):
+        ws.write_row(r, 0, row)
+        ws.write(r, SUMMARY_STATUS_COL, row.status, status_fmts.get(row.status))
+
+    # ---- Breaches sheet ----
+    ws_b = wb.add_worksheet("Breaches")
+    breach_header_fmt = wb.add_format({"bold": True, "font_color": "FFFFFF",
+                                       "pattern": 1, "bg_color": BREACH_HEADER_COLOR})
+    zebra_fmts = [wb.add_format({"pattern": 1, "bg_color": color}) for color in ZEBRA_COLORS]
+
+    ws_b.freeze_panes(1, 0)
+    for col, width in enumerate(_column_widths(BREACH_HEADERS, breach_rows)):
+        ws_b.set_column(col, col, width)
+    ws_b.write_row(0, 0, BREACH_HEADERS, breach_header_fmt)
+
+    for r, (row, zebra_idx) in enumerate(zip(breach_rows, _zebra_indexes(breach_rows)), 1):
+        ws_b.write_row(r, 0, row, zebra_fmts[zebra_idx])
+
+    wb.close()
+
+
+def _write_output_openpyxl(output_path: str, summary_rows: list[SummaryRow], breach_rows: list[BreachRow]):
+    # Write-only workbooks stream rows to disk as they are appended instead of
+    # holding every cell in memory. Column widths and freeze panes are written
+    # with the sheet header, so they are set before the first row.
+    wb = Workbook(write_only=True)
+
+    # ---- Summary sheet ----
+    ws = wb.create_sheet("Summary")
+    ws.freeze_panes = "A2"
+    _set_column_widths(ws, _column_widths(SUMMARY_HEADERS, summary_rows))
+    ws.append(_header_row(ws, SUMMARY_HEADERS, SUMMARY_HEADER_FILL, HEADER_FONT))
+
+    # Only the status cell is styled; every other column is appended as a plain value
+    for row in summary_rows:
+        status = WriteOnlyCell(ws, value=row.status)
+        status.fill = STATUS_FILLS.get(row.status, DEFAULT_FILL)
+        values = list(row)
+        values[SUMMARY_STATUS_COL] = status
+        ws.append(values)
+
+    # ---- Breaches sheet ----
+    ws_b = wb.create_sheet("Breaches")
     ws_b.freeze_panes = "A2"
-    for col in ws_b.columns:
-        max_len = max((len(str(cell.value or "")) for cell in col), default=10)
-        ws_b.column_dimensions[get_column_letter(col[0].column)].width = min(max_len + 4, 60)
+    _set_column_widths(ws_b, _column_widths(BREACH_HEADERS, breach_rows))
+    ws_b.append(_header_row(ws_b, BREACH_HEADERS, BREACH_HEADER_FILL, HEADER_FONT))
+
+    for row, zebra_idx in zip(breach_rows, _zebra_indexes(breach_rows)):
+        fill = ZEBRA_FILLS[zebra_idx]
+        cells = [WriteOnlyCell(ws_b, value=v) for v in row]
+        for cell in cells:
+            cell.fill = fill
+        ws_b.append(cells)
 
     wb.save(output_path)
 
 
+# ---- Direct XML backend ----
+# The report layout is fixed (two sheets, a handful of fills), so the default
+# writer emits the SpreadsheetML parts as templated strings and zips them,
+# skipping per-cell library objects entirely. Strings are written inline.
+
+_XML_HEAD = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+_XML_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+_XML_REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+_XML_PKG_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+# cellXfs order: 0 default, 1 Summary header, 2 Breaches header, then one per
+# status, then the two zebra bands. Fill ids are offset by the two fills the
+# format reserves (none, gray125).
+_XML_FILL_COLORS = (SUMMARY_HEADER_COLOR, BREACH_HEADER_COLOR, *STATUS_COLORS.values(), *ZEBRA_COLORS)
+_XF_SUMMARY_HEADER = 1
+_XF_BREACH_HEADER = 2
+_XF_STATUS = {status: 3 + i for i, status in enumerate(STATUS_COLORS)}
+_XF_ZEBRA = (3 + len(STATUS_COLORS), 4 + len(STATUS_COLORS))
+
+_CONTENT_TYPES_XML = (
+    _XML_HEAD
+    + '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet2.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '<Override PartName="/xl/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '</Types>'
+)
+_ROOT_RELS_XML = (
+    _XML_HEAD
+    + f'<Relationships xmlns="{_XML_PKG_REL_NS}">'
+    f'<Relationship Id="rId1" Type="{_XML_REL_NS}/officeDocument" Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+_WORKBOOK_XML = (
+    _XML_HEAD
+    + f'<workbook xmlns="{_XML_NS}" xmlns:r="{_XML_REL_NS}"><sheets>'
+    '<sheet name="Summary" sheetId="1" r:id="rId1"/>'
+    '<sheet name="Breaches" sheetId="2" r:id="rId2"/>'
+    '</sheets></workbook>'
+)
+_WORKBOOK_RELS_XML = (
+    _XML_HEAD
+    + f'<Relationships xmlns="{_XML_PKG_REL_NS}">'
+    f'<Relationship Id="rId1" Type="{_XML_REL_NS}/worksheet" Target="worksheets/sheet1.xml"/>'
+    f'<Relationship Id="rId2" Type="{_XML_REL_NS}/worksheet" Target="worksheets/sheet2.xml"/>'
+    f'<Relationship Id="rId3" Type="{_XML_REL_NS}/styles" Target="styles.xml"/>'
+    '</Relationships>'
+)
+_STYLES_XML = (
+    _XML_HEAD
+    + f'<styleSheet xmlns="{_XML_NS}">'
+    '<fonts count="2">'
+    '<font><sz val="11"/><name val="Calibri"/><family val="2"/></font>'
+    '<font><b/><sz val="11"/><color rgb="FFFFFFFF"/><name val="Calibri"/><family val="2"/></font>'
+    '</fonts>'
+    f'<fills count="{2 + len(_XML_FILL_COLORS)}">'
+    '<fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill>'
+    + "".join(f'<fill><patternFill patternType="solid"><fgColor rgb="FF{color}"/>'
+              f'<bgColor indexed="64"/></patternFill></fill>' for color in _XML_FILL_COLORS)
+    + '</fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    f'<cellXfs count="{1 + len(_XML_FILL_COLORS)}">'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    + "".join(f'<xf numFmtId="0" fontId="{1 if i < 2 else 0}" fillId="{2 + i}" borderId="0" xfId="0" '
+              f'applyFont="1" applyFill="1"/>' for i in range(len(_XML_FILL_COLORS)))
+    + '</cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+
+# Control characters XML 1.0 cannot carry
+_ILLEGAL_XML_CHARS = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+def _xml_cell(ref: str, value, style: int) -> str:
+    s = f' s="{style}"' if style else ""
+    if isinstance(value, (float, np.floating)) and not math.isfinite(value):
+        value = None  # as openpyxl does: NaN / inf become blank cells
+    if value is None or value == "":
+        return f'<c r="{ref}"{s}/>' if style else ""
+    if isinstance(value, bool):
+        return f'<c r="{ref}"{s} t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, np.integer)):
+        return f'<c r="{ref}"{s}><v>{int(value)}</v></c>'
+    if isinstance(value, (float, np.floating)):
+        # 16 significant digits, the same rendering openpyxl and xlsxwriter use
+        return f'<c r="{ref}"{s}><v>{value:.16g}</v></c>'
+    text = xml_escape(_ILLEGAL_XML_CHARS.sub("", str(value)))
+    return f'<c r="{ref}"{s} t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _write_xml_sheet(zf: zipfile.ZipFile, name: str, headers: tuple[str, ...], header_style: int,
+                     rows: list[tuple], row_styles):
+    """
+    Stream one frozen-header worksheet part into the archive, a row at a
+    time, so memory stays flat however many rows there are; row_styles
+    yields each row's per-column style ids.
+    """
+    letters = [get_column_letter(col) for col in range(1, len(headers) + 1)]
+    cols = "".join(f'<col min="{col}" max="{col}" width="{width}" customWidth="1"/>'
+                   for col, width in enumerate(_column_widths(headers, rows), 1))
+    with io.TextIOWrapper(zf.open(name, "w"), encoding="utf-8") as f:
+        f.write(
+            _XML_HEAD
+            + f'<worksheet xmlns="{_XML_NS}">'
+            '<sheetViews><sheetView workbookViewId="0">'
+            '<pane ySplit="1" topLeftCell="A2" activePane="bottomLeft" state="frozen"/>'
+            '<selection pane="bottomLeft" activeCell="A2" sqref="A2"/>'
+            '</sheetView></sheetViews>'
+            f'<cols>{cols}</cols>'
+            '<sheetData>'
+        )
+        f.write('<row r="1">' + "".join(_xml_cell(f"{c}1", h, header_style)
+                                        for c, h in zip(letters, headers)) + "</row>")
+        for r, (row_values, styles) in enumerate(zip(rows, row_styles), 2):
+            f.write(f'<row r="{r}">' + "".join(_xml_cell(f"{c}{r}", v, style)
+                                               for c, v, style in zip(letters, row_values, styles)) + "</row>")
+        f.write('</sheetData></worksheet>')
+
+
+def _write_output_xml(output_path: str, summary_rows: list[SummaryRow], breach_rows: list[BreachRow]):
+    plain = [0] * len(SUMMARY_HEADERS)
+
+    def summary_styles():
+        for row in summary_rows:
+            styles = plain.copy()
+            styles[SUMMARY_STATUS_COL] = _XF_STATUS.get(row.status, 0)
+            yield styles
+
+    zebra_rows = [[xf] * len(BREACH_HEADERS) for xf in _XF_ZEBRA]
+
+    with zipfile.ZipFile(output_path, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("[Content_Types].xml", _CONTENT_TYPES_XML)
+        zf.writestr("_rels/.rels", _ROOT_RELS_XML)
+        zf.writestr("xl/workbook.xml", _WORKBOOK_XML)
+        zf.writestr("xl/_rels/workbook.xml.rels", _WORKBOOK_RELS_XML)
+        zf.writestr("xl/styles.xml", _STYLES_XML)
+        _write_xml_sheet(zf, "xl/worksheets/sheet1.xml", SUMMARY_HEADERS, _XF_SUMMARY_HEADER,
+                         summary_rows, summary_styles())
+        _write_xml_sheet(zf, "xl/worksheets/sheet2.xml", BREACH_HEADERS, _XF_BREACH_HEADER,
+                         breach_rows, (zebra_rows[zebra_idx] for zebra_idx in _zebra_indexes(breach_rows)))
+
+
+def _write_breaches_csv(path: str, breach_rows: list[BreachRow]):
+    # With a BOM, so Excel opens the file as UTF-8 rather than the ANSI code page
+    with open(path, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.writer(f)
+        writer.writerow(BREACH_HEADERS)
+        writer.writerows(breach_rows)
+
+
+def write_output(output_path: str, summary_rows: list[SummaryRow], breach_rows: list[BreachRow],
+                 legacy_writer: bool = False,
+                 breaches_format: Literal["auto", "csv", "xlsx"] = "auto") -> str | None:
+    """
+    Write the Summary and Breaches sheets. The XML writer is the default;
+    legacy_writer uses the library path — xlsxwriter when installed, else openpyxl.
+
+    With breaches_format "csv" — or "auto" and more than BREACH_CSV_THRESHOLD
+    breaches — the breaches go to <output>.breaches.csv instead and the
+    Breaches sheet keeps only its header row. Returns the CSV path, if any;
+    otherwise a companion CSV left by an earlier run is removed, so it can't
+    be mistaken for this report's breaches.
+    """
+    csv_path = os.path.splitext(output_path)[0] + ".breaches.csv"
+    breaches_path = None
+    if breaches_format == "csv" or (breaches_format == "auto" and len(breach_rows) > BREACH_CSV_THRESHOLD):
+        breaches_path = csv_path
+        _write_breaches_csv(breaches_path, breach_rows)
+        breach_rows = []
+    else:
+        try:
+            os.remove(csv_path)
+        except FileNotFoundError:
+            pass
+        except OSError as exc:  # e.g. still open in Excel — the report itself is unaffected
+            print(f"  [WARN] Could not remove the stale breaches CSV: {exc}")
+
+    if not legacy_writer:
+        _write_output_xml(output_path, summary_rows, breach_rows)
+    elif xlsxwriter is not None:
+        _write_output_xlsxwriter(output_path, summary_rows, breach_rows)
+    else:
+        _write_output_openpyxl(output_path, summary_rows, breach_rows)
+    return breaches_path
+
+
 # ---------------------------------------------------------------------------
 # Step 6 — Console summary
 # ---------------------------------------------------------------------------
 
-def print_summary(fund_id: str, as_of_date: str, summary_rows: list[dict], output_path: str):
+def print_summary(fund_id: str, as_of_date: str, summary_rows: list[SummaryRow], output_path: str,
+                  breaches_path: str | None = None):
     total = len(summary_rows)
-    counts = {"PASS": 0, "FAIL": 0, "ERROR": 0, "SKIPPED": 0}
-    for row in summary_rows:
-        counts[row["status"]] = counts.get(row["status"], 0) + 1
-    total_breaches = sum(int(row.get("breach_count") or 0) for row in summary_rows)
+    # Counter reports 0 for missing statuses, so every line below still prints
+    counts = Counter(row.status for row in summary_rows)
+    total_breaches = sum(row.breach_count for row in summary_rows)
     enabled = total - counts["SKIPPED"]
 
     print("\n" + "=" * 60)
@@ -869,6 +1440,8 @@ def print_summary(fund_id: str, as_of_date: str, summary_rows: list[dict], outpu
     print("-" * 60)
     print(f"Total breaches: {total_breaches}")
     print(f"Output file: {output_path}")
+    if breaches_path:
+        print(f"Breaches:    {breaches_path}")
     print("=" * 60 + "\n")
 
 
@@ -876,6 +1449,9 @@ def print_summary(fund_id: str, as_of_date: str, summary_rows: list[dict], outpu
 # Main
 # ---------------------------------------------------------------------------
 
+_DASH_TABLE = str.maketrans("", "", "-")
+
+
 def main():
     parser = argparse.ArgumentParser(description="Compliance Rule Batch Runner")
     parser.add_argument("--fund-id", required=True, help="Fund ID to check (integer, e.g. 1)")
@@ -885,28 +1461,45 @@ def main():
                         help=f"Path to input rules Excel (default: {DEFAULT_RULES_PATH})")
     parser.add_argument("--output", default=None,
                         help="Path to output Excel (default: compliance_results_<fund>_<date>.xlsx)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help=f"Threads evaluating rules concurrently (default: {DEFAULT_WORKERS}; 1 = serial)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help=f"Ignore and don't update the cross-run result cache ({RESULT_CACHE_PATH})")
+    parser.add_argument("--legacy-writer", action="store_true",
+                        help="Write the report through xlsxwriter/openpyxl instead of the direct XML writer")
+    parser.add_argument("--breaches-format", choices=("auto", "csv", "xlsx"), default="auto",
+                        help=f"Where breaches go: the Breaches sheet (xlsx), <output>.breaches.csv (csv), "
+                             f"or csv above {BREACH_CSV_THRESHOLD:,} breaches (auto, default)")
+    parser.add_argument("--verbose", action="store_true",
+                        help="List each enabled rule before the run and include full tracebacks "
+                             "for uncaught rule exceptions in the output")
     args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
 
     fund_id = args.fund_id
     as_of_date = args.date
-    date_compact = as_of_date.replace("-", "")
-    output_path = args.output or os.path.join(
-        PROJECT_ROOT, f"compliance_results_{fund_id}_{date_compact}.xlsx"
-    )
+    date_compact = as_of_date.translate(_DASH_TABLE)
+    output_path = args.output or str(PROJECT_ROOT_PATH / f"compliance_results_{fund_id}_{date_compact}.xlsx")
 
     print(f"Loading rules from: {args.input}")
     rules = load_rules(args.input)
-    enabled_count = sum(1 for r in rules if str(r.get("enabled", "TRUE")).upper() == "TRUE")
-    print(f"Loaded {len(rules)} rules ({enabled_count} enabled)")
+    enabled_rules = [r for r in rules if r.enabled]
+    print(f"Loaded {len(rules)} rules ({len(enabled_rules)} enabled)")
 
     print(f"Running compliance checks for fund_id={fund_id}, as_of={as_of_date} ...")
-    for r in rules:
-        if str(r.get("enabled", "TRUE")).upper() == "TRUE":
-            print(f"  Checking {r['rule_id']}: {r['rule_text'][:60]}")
-
-    summary_rows, breach_rows = run_rules(rules, fund_id, as_of_date)
-    write_output(output_path, summary_rows, breach_rows)
-    print_summary(fund_id, as_of_date, summary_rows, output_path)
+    if args.verbose and enabled_rules:
+        sys.stdout.write("".join(f"  Checking {r.rule_id}: {r.rule_text[:60]}\n" for r in enabled_rules))
+
+    if not args.no_cache:
+        load_result_cache()
+    summary_rows, breach_rows = run_rules(rules, fund_id, as_of_date, max_workers=args.workers,
+                                         verbose=args.verbose)
+    if not args.no_cache:
+        save_result_cache()
+    breaches_path = write_output(output_path, summary_rows, breach_rows, legacy_writer=args.legacy_writer,
+                                 breaches_format=args.breaches_format)
+    print_summary(fund_id, as_of_date, summary_rows, output_path, breaches_path)
 
 
 if __name__ == "__main__":
@@ -5,7 +5,8 @@ Run once: python scripts/create_sample_rules.py
 """
 
 import os
-import pandas as pd
+
+from openpyxl import Workbook
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 OUTPUT_PATH = os.path.join(SCRIPT_DIR, "compliance_rules.xlsx")
@@ -109,6 +110,13 @@ rules = [
     },
 ]
 
-df = pd.DataFrame(rules)
-df.to_excel(OUTPUT_PATH, sheet_name="Rules", index=False)
+wb = Workbook()
+ws = wb.active
+ws.title = "Rules"
+headers = list(rules[0])
+ws.append(headers)
+for rule in rules:
+    # Blank fields are left as empty cells, not empty strings
+    ws.append([rule[h] or None for h in headers])
+wb.save(OUTPUT_PATH)
 print(f"Created: {OUTPUT_PATH}  ({len(rules)} rules)")
@@ -1,4 +1,4 @@
-import { integer, real, sqliteTable, text } from "drizzle-orm/sqlite-core";
+import { index, integer, real, sqliteTable, text } from "drizzle-orm/sqlite-core";
 
 export const funds = sqliteTable("funds", {
   id: integer("id").primaryKey({ autoIncrement: true }),
@@ -27,7 +27,15 @@ export const positions = sqliteTable("positions", {
   market_value_usd: real("market_value_usd").notNull(),
   weight_pct: real("weight_pct").notNull(),
   compliance_status: text("compliance_status").notNull(),
-});
+}, (t) => [
+  // Covering index for the compliance batch runner's per-fund positions scan
+  // (scripts/compliance_batch_runner.py); SQLite walks it backwards for
+  // ORDER BY weight_pct DESC, so the scan needs no sort step.
+  index("idx_positions_fund_weight").on(
+    t.fund_id, t.weight_pct, t.isin, t.security_name,
+    t.asset_class, t.country, t.sector, t.compliance_status,
+  ),
+]);
 
 export const compliance_rules = sqliteTable("compliance_rules", {
   id: integer("id").primaryKey({ autoIncrement: true }),